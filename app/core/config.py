@@ -1,5 +1,6 @@
 import os
-from pydantic_settings import BaseSettings
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
@@ -13,10 +14,27 @@ class Settings(BaseSettings):
     REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
     REDIS_PASSWORD: str = os.getenv("REDIS_PASSWORD", "")
 
-    class Config:
-        env_file = ".env"
-        case_sensitive = True
-        extra = "ignore"  # This allows extra fields without validation errors
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        case_sensitive=True,
+        extra="ignore",  # This allows extra fields without validation errors
+        frozen=True,  # Settings are read once and never change at runtime
+    )
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Get the application settings, parsed from the environment only once."""
+    return Settings()
+
 
+settings = get_settings()
 
-settings = Settings()
+# Redis connection arguments, resolved once from the settings
+REDIS_KW = dict(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    db=settings.REDIS_DB,
+    # An empty password means no authentication
+    password=settings.REDIS_PASSWORD or None,
+)
@@ -1,11 +1,21 @@
+import logging
+from sqlalchemy import insert, select, update
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Iterable, List, Optional
 
 from app.models.device import Device, DeviceStatus
 from app.models.device_history import DeviceHistory
 from app.redis.client import RedisClient
 
+logger = logging.getLogger(__name__)
+
+
+def _format_timestamp(timestamp: datetime) -> str:
+    """Format a timestamp as "YYYY-MM-DD HH:MM:SS" (cheaper than strftime)."""
+    return timestamp.isoformat(sep=" ", timespec="seconds")
+
 
 def get_device(db: Session, device_id: int) -> Optional[Device]:
     """Get a device by ID"""
@@ -16,6 +26,42 @@ def get_device(db: Session, device_id: int) -> Optional[Device]:
     return device
 
 
+def get_latest_history_by_device(
+    db: Session, device_ids: Iterable[int]
+) -> Dict[int, Row]:
+    """
+    Get the most recent history entry for each of the given devices.
+
+    Uses a single PostgreSQL DISTINCT ON query instead of one query per device,
+    which the (device_id, timestamp DESC) index serves directly, and returns
+    plain Core rows since callers only read them.
+
+    Args:
+        db: The database session
+        device_ids: The IDs of the devices to look up
+
+    Returns:
+        dict: Row with device_id, timestamp, event and data of the latest
+        entry, keyed by device ID; devices without any history are omitted
+    """
+    device_ids = list(device_ids)
+    if not device_ids:
+        return {}
+
+    rows = db.execute(
+        select(
+            DeviceHistory.device_id,
+            DeviceHistory.timestamp,
+            DeviceHistory.event,
+            DeviceHistory.data,
+        )
+        .where(DeviceHistory.device_id.in_(device_ids))
+        .distinct(DeviceHistory.device_id)
+        .order_by(DeviceHistory.device_id, DeviceHistory.timestamp.desc())
+    ).all()
+    return {row.device_id: row for row in rows}
+
+
 def update_device_status(db: Session, device_id: int, status: str) -> bool:
     """
     Update only the status field of a device, avoiding any issues with other fields.
@@ -30,43 +76,38 @@ def update_device_status(db: Session, device_id: int, status: str) -> bool:
         bool: True if successful, False otherwise
     """
     try:
-        # Fetch the current status of the device
-        db_device = get_device(db, device_id)
-        if not db_device:
+        # Update the status and read back the previous one in a single statement;
+        # the self-join exposes the row as it was before the update
+        devices = Device.__table__
+        previous = devices.alias("previous")
+        row = db.execute(
+            update(devices)
+            .where(devices.c.id == device_id, previous.c.id == devices.c.id)
+            .values(status=status)
+            .returning(previous.c.status, devices.c.expected_transmit_time)
+        ).one_or_none()
+        if row is None:
+            db.rollback()
             return False
 
-        current_status = db_device.status
+        current_status, expected_transmit_time = row
         new_status = status
 
-        # update the device status
-        db_device.status = new_status
-        db.add(db_device)
-        db.commit()
-
-        # If the device is now online, update Redis TTL
-        if new_status == DeviceStatus.ONLINE and db_device.expected_transmit_time:
-            try:
-                redis_client = RedisClient.get_instance()
-                ttl_seconds = db_device.expected_transmit_time * 60
-                redis_client.set_device_online(int(device_id), int(ttl_seconds))
-            except Exception as redis_error:
-                # Log the error but don't fail the status update
-                print(f"Error updating Redis for device {device_id}: {redis_error}")
-
         # create a history entry for the status change
         latest_history = (
-            db.query(DeviceHistory)
+            db.query(DeviceHistory.timestamp)
             .filter(DeviceHistory.device_id == device_id)
             .order_by(DeviceHistory.timestamp.desc())
             .first()
         )
 
-        timestamp = datetime.utcnow()
+        now = datetime.utcnow()
+        timestamp = now
         if latest_history:
             timestamp = latest_history.timestamp
 
         # convert time to a string
-        timestamp_str = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+        timestamp_str = _format_timestamp(timestamp)
 
         db_history = DeviceHistory(
             device_id=device_id,
@@ -77,14 +118,92 @@ def update_device_status(db: Session, device_id: int, status: str) -> bool:
                 "msg": "Device status changed to " + new_status,
                 "last_transmission": timestamp_str,
             },
-            timestamp=datetime.utcnow(),
+            timestamp=now,
         )
         db.add(db_history)
+
+        # Status update and history entry are committed together
         db.commit()
-        db.refresh(db_history)
 
+        # If the device is now online, update Redis TTL
+        if new_status == DeviceStatus.ONLINE and expected_transmit_time:
+            try:
+                redis_client = RedisClient.get_instance()
+                ttl_seconds = expected_transmit_time * 60
+                redis_client.set_device_online(int(device_id), int(ttl_seconds))
+            except Exception as redis_error:
+                # Log the error but don't fail the status update
+                logger.error(
+                    "Error updating Redis for device %s: %s", device_id, redis_error
+                )
+
+        return True
+    except Exception as e:
+        # Log the error
+        logger.error("Error updating device status: %s", e)
+        db.rollback()
+        return False
+
+
+def bulk_mark_offline(db: Session, device_ids: List[int]) -> bool:
+    """
+    Mark several devices as OFFLINE and record a history entry for each,
+    using one UPDATE and one multi-row INSERT in a single transaction.
+
+    Args:
+        db: The database session
+        device_ids: The IDs of the devices to update
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    # The same device can expire more than once within a batch
+    device_ids = list(dict.fromkeys(device_ids))
+    if not device_ids:
+        return True
+
+    try:
+        devices = Device.__table__
+        previous = devices.alias("previous")
+        rows = db.execute(
+            update(devices)
+            .where(devices.c.id.in_(device_ids), previous.c.id == devices.c.id)
+            .values(status=DeviceStatus.OFFLINE)
+            .returning(devices.c.id, previous.c.status)
+        ).all()
+        if not rows:
+            db.rollback()
+            return False
+
+        latest_history = get_latest_history_by_device(db, [row.id for row in rows])
+
+        # One clock read and one formatted "now" for the whole batch
+        now = datetime.utcnow()
+        now_str = _format_timestamp(now)
+
+        history_rows = []
+        for device_id, current_status in rows:
+            history = latest_history.get(device_id)
+            timestamp_str = _format_timestamp(history.timestamp) if history else now_str
+            history_rows.append(
+                {
+                    "device_id": device_id,
+                    "event": "status_change",
+                    "data": {
+                        "status": DeviceStatus.OFFLINE,
+                        "previous_status": current_status,
+                        "msg": "Device status changed to " + DeviceStatus.OFFLINE,
+                        "last_transmission": timestamp_str,
+                    },
+                    "timestamp": now,
+                }
+            )
+        db.execute(insert(DeviceHistory.__table__), history_rows)
+
+        db.commit()
         return True
     except Exception as e:
         # Log the error
-        print(f"Error updating device status: {e}")
+        logger.error("Error marking devices %s offline: %s", device_ids, e)
+        db.rollback()
         return False
@@ -3,7 +3,9 @@ from sqlalchemy import (
     Integer,
     String,
     DateTime,
+    Enum,
     ForeignKey,
+    Index,
 )
 from datetime import datetime
 from app.db.database import Base
@@ -26,8 +28,29 @@ class Device(Base):
     )  # Made nullable for testing
     app_eui = Column(String(16), nullable=True)  # Made nullable for testing
     app_key = Column(String(32), nullable=True)  # Made nullable for testing
-    status = Column(String, default=DeviceStatus.OFFLINE)
+    # Native Postgres ENUM storing the lowercase member values
+    status = Column(
+        Enum(
+            DeviceStatus,
+            name="device_status",
+            values_callable=lambda statuses: [status.value for status in statuses],
+        ),
+        default=DeviceStatus.OFFLINE,
+        nullable=False,
+        index=True,
+    )
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     # Expected transmit time in minutes (from 1 minute to 24 hours)
     expected_transmit_time = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # Serves the start-up scan for monitored devices that are not OFFLINE
+        Index(
+            "ix_devices_active",
+            "status",
+            "expected_transmit_time",
+            "id",
+            postgresql_where=expected_transmit_time.isnot(None),
+        ),
+    )
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, func
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
 from app.db.database import Base
 
@@ -9,5 +10,15 @@ class DeviceHistory(Base):
     id = Column(Integer, primary_key=True, index=True)
     device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
     event = Column(String, nullable=False)
-    data = Column(JSON, nullable=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    data = Column(JSONB, nullable=True)
+    timestamp = Column(
+        DateTime,
+        default=datetime.utcnow,
+        server_default=func.timezone("utc", func.now()),
+    )
+
+    __table_args__ = (
+        # Serves the "latest history entry for a device" lookups
+        # (WHERE device_id = ? ORDER BY timestamp DESC LIMIT 1)
+        Index("ix_device_history_device_ts", "device_id", timestamp.desc()),
+    )
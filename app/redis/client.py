@@ -5,29 +5,123 @@ This client can be used to update Redis key TTLs when device data is received.
 """
 
 import redis
+import socket
 import logging
-from typing import Optional
+import threading
+from typing import Dict, Optional, Tuple
+from app.core.config import REDIS_KW
 
 logger = logging.getLogger(__name__)
 
 # Redis key prefix (must match the one used in the device status service)
 DEVICE_STATUS_KEY_PREFIX = "device:status:"
 
+# Creates a device key with its TTL and returns 1 if it did not exist beforehand
+# (the device is coming online); otherwise extends the TTL, never shortening it,
+# and returns 0. The TTLs are compared in the script instead of using EXPIRE GT,
+# which Redis only supports from 7.0
+SET_ONLINE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[2], 'NX', 'EX', ARGV[1]) then
+    return 1
+end
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+# Maximum number of connections held by each shared connection pool
+MAX_CONNECTIONS = 32
+
+# Seconds to wait for a connection or a reply before giving up
+SOCKET_TIMEOUT = 5
+
+# Seconds a pooled connection may sit idle before it is health-checked with PING
+HEALTH_CHECK_INTERVAL = 30
+
+# TCP keepalive: start probing after 60s idle, probe every 30s, drop after 3
+# failed probes (options not available on this platform are skipped)
+SOCKET_KEEPALIVE_OPTIONS = {
+    getattr(socket, name): value
+    for name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 30), ("TCP_KEEPCNT", 3))
+    if hasattr(socket, name)
+}
+
+# Options applied to every Redis connection pool
+POOL_OPTIONS = dict(
+    max_connections=MAX_CONNECTIONS,
+    socket_timeout=SOCKET_TIMEOUT,
+    socket_connect_timeout=SOCKET_TIMEOUT,
+    socket_keepalive=True,
+    socket_keepalive_options=SOCKET_KEEPALIVE_OPTIONS,
+    health_check_interval=HEALTH_CHECK_INTERVAL,
+    retry_on_timeout=True,
+    decode_responses=True,
+)
+
+# Connection pools shared by every Redis client in the process
+_POOLS: Dict[Tuple, redis.ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_connection_pool(
+    host="localhost", port=6379, db=0, password=None
+) -> redis.ConnectionPool:
+    """
+    Get the process-wide connection pool for a Redis server, creating it on first use.
+
+    Args:
+        host: Redis host
+        port: Redis port
+        db: Redis database number
+        password: Redis password
+
+    Returns:
+        redis.ConnectionPool: The shared pool for these connection settings
+    """
+    key = (host, port, db, password)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = redis.BlockingConnectionPool(
+                host=host,
+                port=port,
+                db=db,
+                password=password,
+                **POOL_OPTIONS,
+            )
+            _POOLS[key] = pool
+        return pool
+
 
 class RedisClient:
     """Redis client for device status management."""
 
+    # Shared instance configured from the application settings
+    _instance: Optional["RedisClient"] = None
+
+    @classmethod
+    def get_instance(cls) -> "RedisClient":
+        """Get or create the shared client configured from the application settings."""
+        if cls._instance is None:
+            cls._instance = cls(**REDIS_KW)
+        return cls._instance
+
     def __init__(self, host="localhost", port=6379, db=0, password=None):
         """Initialize Redis connection."""
         self.redis = redis.Redis(
-            host=host, port=port, db=db, password=password, decode_responses=True
+            connection_pool=get_connection_pool(host, port, db, password)
         )
+        self._set_online_script = self.redis.register_script(SET_ONLINE_SCRIPT)
         logger.info(f"Redis client initialized: {host}:{port}/db{db}")
 
     def set_device_online(self, device_id: int, ttl_seconds: int) -> bool:
         """
         Mark a device as online by setting a Redis key with TTL.
 
+        An existing key only has its TTL extended, never shortened, atomically
+        in a Lua script and in a single round-trip.
+
         Args:
             device_id: Unique identifier for the device
             ttl_seconds: Time-to-live in seconds before the device is considered offline
@@ -39,8 +133,8 @@ class RedisClient:
         try:
             # Ensure TTL is at least 1 second
             ttl_seconds = max(1, ttl_seconds)
-            self.redis.setex(key, ttl_seconds, "online")
-            logger.debug(f"Device {device_id} set online with TTL of {ttl_seconds}s")
+            self._set_online_script(keys=[key], args=[ttl_seconds, "online"])
+            logger.debug("Device %s set online with TTL of %ss", device_id, ttl_seconds)
             return True
         except redis.exceptions.RedisError as e:
             logger.error(f"Error setting device {device_id} online: {e}")
@@ -4,32 +4,79 @@ Redis manager for device status service.
 Handles Redis connections and operations related to device status tracking.
 """
 
+import sys
 import redis
 import logging
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
 from app.models.device import DeviceStatus
+from app.redis.client import SET_ONLINE_SCRIPT, get_connection_pool
 
 logger = logging.getLogger(__name__)
 
+# Value returned by the Redis TTL command when the key does not exist
+KEY_MISSING_TTL = -2
+
 
 class RedisDeviceManager:
     """Manages device status using Redis TTL mechanism."""
 
     # Prefix for device status keys in Redis
-    KEY_PREFIX = "device:status:"
-
-    def __init__(self, host="localhost", port=6379, db=0, password=None):
-        """Initialize Redis connection."""
-        self.redis = redis.Redis(
-            host=host,
-            port=port,
-            db=db,
-            password=password,
-            decode_responses=True,  # Return strings instead of bytes
-        )
+    KEY_PREFIX = sys.intern("device:status:")
+    KEY_PREFIX_LEN = len(KEY_PREFIX)
+
+    # Maximum number of commands sent in a single pipeline round-trip
+    PIPELINE_BATCH_SIZE = 1000
+
+    # Number of encoded device keys kept by device_key
+    KEY_CACHE_SIZE = 10_000
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=0,
+        password=None,
+        client: Optional[redis.Redis] = None,
+    ):
+        """
+        Initialize Redis connection.
+
+        Args:
+            host: Redis host, ignored when client is given
+            port: Redis port, ignored when client is given
+            db: Redis database number, ignored when client is given
+            password: Redis password, ignored when client is given
+            client: Existing Redis client to share instead of creating one on
+                the shared connection pool for host, port, db and password
+        """
+        if client is None:
+            client = redis.Redis(
+                connection_pool=get_connection_pool(host, port, db, password)
+            )
+        self.redis = client
+        self._set_online_script = self.redis.register_script(SET_ONLINE_SCRIPT)
         self._configure_keyspace_events()
         logger.info(f"Redis connection established to {host}:{port}/db{db}")
 
+    @staticmethod
+    @lru_cache(maxsize=KEY_CACHE_SIZE)
+    def device_key(device_id: int) -> bytes:
+        """
+        Get the Redis key of a device.
+
+        Keys are cached and returned as bytes, so repeated lookups of the same
+        devices skip both the string formatting and redis-py's encoding. Any ID
+        is formatted as given, so "5" and 5 map to the same key.
+
+        Args:
+            device_id: Unique identifier for the device
+
+        Returns:
+            bytes: The device's status key
+        """
+        return f"{RedisDeviceManager.KEY_PREFIX}{device_id}".encode()
+
     def _configure_keyspace_events(self):
         """Configure Redis to emit keyspace events for key expiration."""
         try:
@@ -45,6 +92,9 @@ class RedisDeviceManager:
         """
         Mark a device as online by setting a Redis key with TTL.
 
+        An existing key only has its TTL extended, never shortened, atomically
+        in a Lua script and in a single round-trip.
+
         Args:
             device_id: Unique identifier for the device
             ttl_seconds: Time-to-live in seconds before the device is considered offline
@@ -52,17 +102,79 @@ class RedisDeviceManager:
         Returns:
             bool: Success status
         """
-        key = f"{self.KEY_PREFIX}{device_id}"
         try:
+            key = self.device_key(device_id)
             # Ensure TTL is at least 1 second
             ttl_seconds = max(1, ttl_seconds)
-            self.redis.setex(key, ttl_seconds, DeviceStatus.ONLINE)
-            logger.debug(f"Device {device_id} set online with TTL of {ttl_seconds}s")
+            self._set_online_script(keys=[key], args=[ttl_seconds, DeviceStatus.ONLINE])
+            logger.debug("Device %s set online with TTL of %ss", device_id, ttl_seconds)
             return True
         except redis.exceptions.RedisError as e:
             logger.error(f"Error setting device {device_id} online: {e}")
             return False
 
+    def mark_device_online(self, device_id: int, ttl_seconds: int) -> Optional[bool]:
+        """
+        Mark a device as online and report whether it was offline before.
+
+        Runs SET NX EX, then raises the TTL when the key already exists and
+        has less time left, atomically in a Lua script and in a single
+        round-trip. An existing TTL is only extended, never shortened.
+
+        Args:
+            device_id: Unique identifier for the device
+            ttl_seconds: Time-to-live in seconds before the device is considered offline
+
+        Returns:
+            bool: True if the device key had expired (the device just came online),
+            False if its TTL was only extended, None on error
+        """
+        try:
+            key = self.device_key(device_id)
+            # Ensure TTL is at least 1 second
+            ttl_seconds = max(1, ttl_seconds)
+            transitioned = self._set_online_script(
+                keys=[key], args=[ttl_seconds, DeviceStatus.ONLINE]
+            )
+            logger.debug("Device %s set online with TTL of %ss", device_id, ttl_seconds)
+            return bool(transitioned)
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Error setting device {device_id} online: {e}")
+            return None
+
+    def set_devices_online_bulk(self, devices: Iterable[Tuple[int, int]]) -> bool:
+        """
+        Mark several devices as online using pipelined SET ... EX commands.
+
+        On a Redis Cluster client the pipeline already groups the commands by
+        node, so each node still receives its keys in a single batch.
+
+        Args:
+            devices: (device_id, ttl_seconds) pairs
+
+        Returns:
+            bool: Success status
+        """
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            count = 0
+            for device_id, ttl_seconds in devices:
+                # Ensure TTL is at least 1 second
+                pipe.set(
+                    self.device_key(device_id),
+                    DeviceStatus.ONLINE,
+                    ex=max(1, ttl_seconds),
+                )
+                count += 1
+                if count % self.PIPELINE_BATCH_SIZE == 0:
+                    pipe.execute()
+            pipe.execute()
+            logger.debug("%s devices set online in bulk", count)
+            return True
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Error setting devices online in bulk: {e}")
+            return False
+
     def get_device_status(self, device_id: int) -> Optional[str]:
         """
         Get current device status from Redis.
@@ -73,19 +185,71 @@ class RedisDeviceManager:
         Returns:
             str: "online" if device key exists, None otherwise
         """
-        key = f"{self.KEY_PREFIX}{device_id}"
         try:
-            if self.redis.exists(key):
-                ttl = self.redis.ttl(key)
-                logger.debug(f"Device {device_id} is online with {ttl}s remaining")
-                return DeviceStatus.ONLINE
-            else:
-                logger.debug(f"Device {device_id} is offline (no Redis key)")
+            key = self.device_key(device_id)
+            # TTL returns -2 when the key does not exist, so a single command
+            # tells us both whether the device is online and for how long
+            ttl = self.redis.ttl(key)
+            if ttl == KEY_MISSING_TTL:
+                logger.debug("Device %s is offline (no Redis key)", device_id)
                 return DeviceStatus.OFFLINE
+            logger.debug("Device %s is online with %ss remaining", device_id, ttl)
+            return DeviceStatus.ONLINE
         except redis.exceptions.RedisError as e:
             logger.error(f"Error getting status for device {device_id}: {e}")
             return None
 
+    def get_many_key_states(
+        self, device_ids: Iterable[int]
+    ) -> Optional[Dict[int, int]]:
+        """
+        Get the raw TTL reply for several device keys in one round-trip.
+
+        TTL replies -2 for a missing key, -1 for a key without expiry and the
+        remaining seconds otherwise, so this one small integer per device covers
+        both key existence and remaining TTL.
+
+        Args:
+            device_ids: Unique identifiers of the devices
+
+        Returns:
+            dict: TTL reply keyed by device ID, or None if Redis could not be queried
+        """
+        device_ids = list(device_ids)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for device_id in device_ids:
+                pipe.ttl(self.device_key(device_id))
+            return dict(zip(device_ids, pipe.execute()))
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Error getting key states for {len(device_ids)} devices: {e}")
+            return None
+
+    def get_many_device_statuses(
+        self, device_ids: Iterable[int]
+    ) -> Dict[int, Optional[str]]:
+        """
+        Get current status of several devices from Redis in one round-trip.
+
+        Args:
+            device_ids: Unique identifiers of the devices
+
+        Returns:
+            dict: "online"/"offline" keyed by device ID, or None for every
+            device if Redis could not be queried
+        """
+        device_ids = list(device_ids)
+        ttls = self.get_many_key_states(device_ids)
+        if ttls is None:
+            return {device_id: None for device_id in device_ids}
+
+        return {
+            device_id: (
+                DeviceStatus.OFFLINE if ttl == KEY_MISSING_TTL else DeviceStatus.ONLINE
+            )
+            for device_id, ttl in ttls.items()
+        }
+
     def get_device_ttl(self, device_id: int) -> Optional[int]:
         """
         Get remaining TTL for a device.
@@ -96,14 +260,43 @@ class RedisDeviceManager:
         Returns:
             int: Remaining TTL in seconds, or None if device is offline
         """
-        key = f"{self.KEY_PREFIX}{device_id}"
         try:
+            key = self.device_key(device_id)
             ttl = self.redis.ttl(key)
             return ttl if ttl > 0 else None
         except redis.exceptions.RedisError as e:
             logger.error(f"Error getting TTL for device {device_id}: {e}")
             return None
 
+    def get_many_device_snapshots(
+        self, device_ids: Iterable[int]
+    ) -> Dict[int, Tuple[Optional[str], Optional[int]]]:
+        """
+        Get status and remaining TTL of several devices in one round-trip.
+
+        Both values are derived from a single pipelined TTL per device.
+
+        Args:
+            device_ids: Unique identifiers of the devices
+
+        Returns:
+            dict: (status, ttl) keyed by device ID, where status is "online" or
+            "offline" and ttl is the remaining TTL in seconds or None, as
+            returned by get_device_status and get_device_ttl
+        """
+        device_ids = list(device_ids)
+        ttls = self.get_many_key_states(device_ids)
+        if ttls is None:
+            return {device_id: (None, None) for device_id in device_ids}
+
+        return {
+            device_id: (
+                DeviceStatus.OFFLINE if ttl == KEY_MISSING_TTL else DeviceStatus.ONLINE,
+                ttl if ttl > 0 else None,
+            )
+            for device_id, ttl in ttls.items()
+        }
+
     def remove_device(self, device_id: int) -> bool:
         """
         Remove device status from Redis.
@@ -114,10 +307,10 @@ class RedisDeviceManager:
         Returns:
             bool: Success status
         """
-        key = f"{self.KEY_PREFIX}{device_id}"
         try:
+            key = self.device_key(device_id)
             self.redis.delete(key)
-            logger.debug(f"Device {device_id} removed from Redis")
+            logger.debug("Device %s removed from Redis", device_id)
             return True
         except redis.exceptions.RedisError as e:
             logger.error(f"Error removing device {device_id}: {e}")
@@ -134,9 +327,9 @@ class RedisDeviceManager:
         Returns:
             int: Device ID or None if key format is invalid
         """
-        if key and key.startswith(cls.KEY_PREFIX):
-            try:
-                return int(key[len(cls.KEY_PREFIX) :])
-            except ValueError:
-                return None
-        return None
+        # Called for every keyspace event, so avoid raising on non-device keys
+        prefix_len = cls.KEY_PREFIX_LEN
+        if not key or len(key) <= prefix_len or key[:prefix_len] != cls.KEY_PREFIX:
+            return None
+        device_id = key[prefix_len:]
+        return int(device_id) if device_id.isdecimal() else None
@@ -1,105 +1,256 @@
 #!/usr/bin/env python3
 """
 Redis subscriber for device status events.
-Listens for Redis keyspace events and updates device statuses in the database.
+Listens for Redis keyspace events with redis.asyncio and updates device
+statuses in the database over asyncpg, all on a single event loop.
 """
 
 import os
 import sys
-import time
+import asyncio
 import logging
 import threading
 import signal
-from redis import Redis
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
 
 # Add parent directory to path so we can import app modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
+from app.core.config import REDIS_KW, settings
+from app.redis.client import POOL_OPTIONS
 from app.redis.redis_manager import RedisDeviceManager
-from app.db.database import SessionLocal
-from app.models.device import DeviceStatus
-from app.crud.device import update_device_status
+from app.crud.device import bulk_mark_offline
 
 logger = logging.getLogger(__name__)
 
+# Number of worker coroutines writing status changes to the database
+DEFAULT_WORKER_COUNT = 4
+
+# Maximum number of expired devices waiting to be written to the database
+MAX_PENDING_EVENTS = 10000
+
+# Expired devices are coalesced into batches of at most MAX_BATCH_SIZE,
+# collected over at most BATCH_WINDOW_SECONDS, before being written
+MAX_BATCH_SIZE = 500
+BATCH_WINDOW_SECONDS = 0.1
+
+# Seconds start() waits for the subscription, and stop() for the remaining
+# events to be written, when the subscriber runs in a background thread
+STARTUP_TIMEOUT_SECONDS = 10
+SHUTDOWN_TIMEOUT_SECONDS = 30
+
+
+def _async_database_url(database_url: str) -> str:
+    """Switch a SQLAlchemy database URL to the asyncpg driver."""
+    url = make_url(database_url).set(drivername="postgresql+asyncpg")
+    return url.render_as_string(hide_password=False)
+
 
 class DeviceStatusSubscriber:
     """
     Subscriber for Redis keyspace events related to device status.
-    Listens for expired keys and updates device status in the database.
+    Expired keys are queued, coalesced into batches and written to the
+    database by worker coroutines, so one thread services the whole event
+    stream. Run it with run() on an event loop, or with start() in a
+    background thread.
     """
 
-    def __init__(self, host="localhost", port=6379, db=0, password=None):
-        """Initialize Redis pubsub connection."""
-        self.redis = Redis(
-            host=host, port=port, db=db, password=password, decode_responses=True
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=0,
+        password=None,
+        worker_count=DEFAULT_WORKER_COUNT,
+        database_url=None,
+    ):
+        """Initialize the Redis client; database connections are made in run()."""
+        self.redis = aioredis.Redis(
+            connection_pool=aioredis.BlockingConnectionPool(
+                host=host, port=port, db=db, password=password, **POOL_OPTIONS
+            )
         )
-        self.pubsub = self.redis.pubsub()
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.database_url = _async_database_url(database_url or settings.DATABASE_URL)
+        self.worker_count = worker_count
         self.running = False
         self.thread = None
-        self.device_mgr = RedisDeviceManager(host, port, db, password)
+        self.subscribed = threading.Event()
+        self.queue = None
+        self.batches = None
         logger.info(f"Device status subscriber initialized: {host}:{port}/db{db}")
 
     def start(self):
-        """Start the subscriber in a separate thread."""
-        self._subscribe_to_events()
-        self.running = True
-        self.thread = threading.Thread(target=self._listen_for_events)
+        """
+        Run the subscriber on its own event loop in a background thread.
+
+        Returns once expiration events are being received, so that no key set
+        afterwards can expire unobserved.
+        """
+        self.subscribed.clear()
+        self.thread = threading.Thread(
+            target=asyncio.run, args=(self.run(),), name="status-subscriber"
+        )
         self.thread.daemon = True
         self.thread.start()
-        logger.info("Device status subscriber started")
+        subscribed = self.subscribed.wait(timeout=STARTUP_TIMEOUT_SECONDS)
+        if not subscribed or not self.running:
+            raise RuntimeError("Device status subscriber failed to start")
 
     def stop(self):
-        """Stop the subscriber."""
+        """
+        Stop the subscriber; queued expirations are still written.
+
+        When started with start(), waits for the background thread to finish.
+        """
         self.running = False
-        if self.thread:
-            self.thread.join(timeout=1.0)
-        self.pubsub.unsubscribe()
-        self.pubsub.close()
-        logger.info("Device status subscriber stopped")
-
-    def _subscribe_to_events(self):
-        """Subscribe to Redis keyspace events for key expiration."""
-        # Subscribe to key expiration events in keyspace notifications
-        self.pubsub.psubscribe("__keyevent@*__:expired")
-        logger.info("Subscribed to Redis key expiration events")
-
-    def _listen_for_events(self):
-        """Listen for Redis keyspace events and process them."""
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=SHUTDOWN_TIMEOUT_SECONDS)
+            self.thread = None
+
+    async def run(self):
+        """Run the subscriber until stop() is called or the listener fails."""
+        self.queue = asyncio.Queue(maxsize=MAX_PENDING_EVENTS)
+        self.batches = asyncio.Queue(maxsize=self.worker_count)
+        engine = create_async_engine(self.database_url, pool_size=self.worker_count)
+        self.running = True
         try:
-            for message in self.pubsub.listen():
-                if not self.running:
-                    break
+            await self._configure_keyspace_events()
+            await self.pubsub.psubscribe("__keyevent@*__:expired")
+            logger.info("Subscribed to Redis key expiration events")
+            self.subscribed.set()
 
-                if message["type"] == "pmessage":
-                    # Extract the expired key name
-                    expired_key = message["data"]
-                    self._process_expired_key(expired_key)
+            session_factory = sessionmaker(engine, class_=AsyncSession)
+            collector = asyncio.create_task(self._collect_batches())
+            workers = [
+                asyncio.create_task(self._process_queue(session_factory))
+                for _ in range(self.worker_count)
+            ]
+            logger.info(
+                f"Device status subscriber started with {self.worker_count} workers"
+            )
+            await self._listen_for_events()
+            await asyncio.gather(collector, *workers)
+        finally:
+            self.running = False
+            # Wake a start() still waiting for the subscription
+            self.subscribed.set()
+            await self.pubsub.aclose()
+            await self.redis.aclose(close_connection_pool=True)
+            await engine.dispose()
+            logger.info("Device status subscriber stopped")
 
+    async def _configure_keyspace_events(self):
+        """Configure Redis to emit keyspace events for key expiration."""
+        try:
+            await self.redis.config_set("notify-keyspace-events", "Ex")
+            logger.info("Redis keyspace events configured for expiration events")
+        except ResponseError as e:
+            logger.warning(f"Could not configure Redis keyspace events: {e}")
+            logger.warning(
+                "You may need to configure Redis manually to enable keyspace events"
+            )
+
+    async def _listen_for_events(self):
+        """Listen for Redis keyspace events and queue expired devices."""
+        try:
+            while self.running:
+                # Wait at most a second so shutdown is noticed promptly
+                message = await self.pubsub.get_message(timeout=1.0)
+                if message and message["type"] == "pmessage":
+                    self._process_expired_key(message["data"])
         except Exception as e:
             logger.error(f"Error in event listener: {e}")
             self.running = False
+        finally:
+            # Mark the end of the events, so the collector flushes what is left
+            await self.queue.put(None)
 
     def _process_expired_key(self, key):
-        """Process an expired key event by updating device status."""
+        """Queue the device of an expired key to be marked offline."""
         device_id = RedisDeviceManager.get_device_id_from_key(key)
         if device_id is None:
-            logger.debug(f"Ignoring non-device key: {key}")
+            logger.debug("Ignoring non-device key: %s", key)
             return
 
-        logger.info(f"Device {device_id} key expired - marking offline")
+        logger.info("Device %s key expired - marking offline", device_id)
 
-        # Update device status in database
-        db = SessionLocal()
+        # Hand the database update to the workers so the listener never
+        # waits on database latency
         try:
-            update_device_status(db, device_id=device_id, status=DeviceStatus.OFFLINE)
-            db.commit()
-            logger.info(f"Device {device_id} status updated to OFFLINE")
-        except Exception as e:
-            logger.error(f"Error updating device {device_id} status: {e}")
-            db.rollback()
-        finally:
-            db.close()
+            self.queue.put_nowait(device_id)
+        except asyncio.QueueFull:
+            logger.error(
+                "Status update queue full, dropping offline event for device %s",
+                device_id,
+            )
+
+    async def _collect_batches(self):
+        """
+        Coalesce expired device IDs from the queue into batches for the workers.
+
+        A single collector drains the queue, so a burst of expirations becomes
+        one batch instead of being spread over every idle worker. Runs until the
+        listener has stopped and every queued ID has been handed over.
+        """
+        done = False
+        while not done:
+            device_ids, done = await self._next_batch()
+            if device_ids:
+                await self.batches.put(device_ids)
+
+        # Let every worker finish once the remaining batches are written
+        for _ in range(self.worker_count):
+            await self.batches.put(None)
+
+    async def _process_queue(self, session_factory):
+        """Worker coroutine marking batches of devices offline in the database."""
+        # Each worker keeps one session for its lifetime; every batch is its
+        # own transaction, committed or rolled back by bulk_mark_offline, which
+        # runs unchanged on the session's asyncpg connection
+        async with session_factory() as db:
+            while True:
+                device_ids = await self.batches.get()
+                if device_ids is None:
+                    break
+                if await db.run_sync(bulk_mark_offline, device_ids):
+                    logger.info("Devices %s status updated to OFFLINE", device_ids)
+
+    async def _next_batch(self):
+        """
+        Collect expired device IDs from the queue.
+
+        Waits for the first ID, then keeps collecting for at most
+        BATCH_WINDOW_SECONDS or until MAX_BATCH_SIZE IDs have been gathered, so
+        devices expiring together are written in a single transaction.
+
+        Returns:
+            tuple: The collected IDs, and whether the listener's end marker was
+            reached
+        """
+        device_id = await self.queue.get()
+        if device_id is None:
+            return [], True
+        device_ids = [device_id]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + BATCH_WINDOW_SECONDS
+        while len(device_ids) < MAX_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                device_id = await asyncio.wait_for(self.queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if device_id is None:
+                return device_ids, True
+            device_ids.append(device_id)
+        return device_ids, False
 
 
 def run_subscriber():
@@ -109,27 +260,25 @@ def run_subscriber():
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     )
 
-    subscriber = DeviceStatusSubscriber()
+    subscriber = DeviceStatusSubscriber(**REDIS_KW)
 
-    # Set up signal handlers for graceful shutdown
-    def signal_handler(sig, frame):
+    async def main():
+        # Set up signal handlers for graceful shutdown
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, signal_handler, sig)
+
+        logger.info("Device status subscriber running. Press Ctrl+C to stop.")
+        await subscriber.run()
+
+    def signal_handler(sig):
         logger.info(f"Received signal {sig}, shutting down...")
         subscriber.stop()
-        sys.exit(0)
-
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
 
     try:
-        subscriber.start()
-        logger.info("Device status subscriber running. Press Ctrl+C to stop.")
-        # Keep the main thread alive
-        while subscriber.running:
-            time.sleep(1)
+        asyncio.run(main())
     except Exception as e:
         logger.error(f"Error in subscriber: {e}")
-    finally:
-        subscriber.stop()
 
 
 if __name__ == "__main__":
@@ -11,11 +11,14 @@ import logging
 
 from app.db.database import SessionLocal
 from app.models.device import Device, DeviceStatus
-from app.models.device_history import DeviceHistory
-from app.crud.device import update_device_status
+from app.crud.device import (
+    bulk_mark_offline,
+    get_latest_history_by_device,
+    update_device_status,
+)
 from app.redis.redis_manager import RedisDeviceManager
 from app.redis.status_subscriber import DeviceStatusSubscriber
-from app.core.config import settings
+from app.core.config import REDIS_KW
 
 from datetime import datetime
 
@@ -36,17 +39,11 @@ class DeviceStatusService:
         self, redis_host=None, redis_port=None, redis_db=0, redis_password=None
     ):
         """Initialize the service with Redis and database connections."""
-        # Use settings if available, otherwise use provided values or defaults
-        self.redis_host = redis_host or getattr(settings, "REDIS_HOST", "localhost")
-        self.redis_port = redis_port or getattr(settings, "REDIS_PORT", 6379)
-        self.redis_db = redis_db or getattr(settings, "REDIS_DB", 0)
-        self.redis_password = redis_password or getattr(
-            settings, "REDIS_PASSWORD", None
-        )
-
-        # if self.redis_password is "", set it to None
-        if self.redis_password == "":
-            self.redis_password = None
+        # Use provided values if given, otherwise the configured settings
+        self.redis_host = redis_host or REDIS_KW["host"]
+        self.redis_port = redis_port or REDIS_KW["port"]
+        self.redis_db = redis_db or REDIS_KW["db"]
+        self.redis_password = redis_password or REDIS_KW["password"]
 
         self.redis_mgr = RedisDeviceManager(
             host=self.redis_host,
@@ -71,67 +68,89 @@ class DeviceStatusService:
         try:
             logger.info("Initializing device statuses in Redis")
 
-            # Get all devices with expected transmission times
+            # Get all devices with expected transmission times, skipping OFFLINE
+            # ones since we dont want to set them online
             devices = (
-                db.query(Device).filter(Device.expected_transmit_time.isnot(None)).all()
+                db.query(Device)
+                .filter(
+                    Device.expected_transmit_time.isnot(None),
+                    Device.status != DeviceStatus.OFFLINE,
+                )
+                .all()
             )
 
             if not devices:
                 logger.info(
-                    "No devices found with expected transmission time configured"
+                    "No non-offline devices found with expected transmission time configured"
                 )
                 return
 
             logger.info(
-                f"Found {len(devices)} devices with expected transmission time configured"
+                f"Found {len(devices)} non-offline devices with expected transmission time configured"
+            )
+
+            # Fetch the latest history entry of every device in one query
+            latest_history = get_latest_history_by_device(
+                db, [device.id for device in devices]
             )
 
+            # Collect (device_id, ttl_seconds) pairs to write to Redis in bulk,
+            # and the devices already overdue, which are marked offline directly
+            online_devices = []
+            overdue_device_ids = []
+
+            # History timestamps are stored in UTC
+            now = datetime.utcnow()
+
             # Initialize each device in Redis
             for device in devices:
-                # first check if the device is offline, if it is we dont want to set it online
-                if device.status == DeviceStatus.OFFLINE:
-                    logger.debug(
-                        f"Device {device.id} ({device.name}) is OFFLINE, skipping initialization"
-                    )
-                    continue
                 # Calculate TTL in seconds
                 ttl_seconds = device.expected_transmit_time * 60
 
-                # we have a ttl_seconds, we need to check the device history and find the last time it was online, marking the ttl_seconds to how longs left until its next expected transmit time
-                device_history = (
-                    db.query(DeviceHistory)
-                    .filter(DeviceHistory.device_id == device.id)
-                    .order_by(DeviceHistory.timestamp.desc())
-                    .first()
-                )
+                # The device is next due expected_transmit_time after its last
+                # recorded event, so only the rest of that period is left
+                device_history = latest_history.get(device.id)
                 if device_history:
                     last_online_time = device_history.timestamp
-                    # we need to update the ttl to be last online time + expected transmit time
-                    # if the last online time is in the future, we need to set the ttl to be the expected transmit time
-                    if last_online_time > datetime.now():
-                        # we need to set the ttl to be the expected transmit time
-                        ttl_seconds = device.expected_transmit_time * 60
-                    else:
-
-                        ttl_seconds = (
-                            datetime.now() - last_online_time
-                        ).total_seconds() + (device.expected_transmit_time * 60)
-
-                    # round to 0 decimal places
-                    ttl_seconds = round(ttl_seconds, 0)
-                    print(
-                        f"Device {device.id} ({device.name}) last online at {last_online_time}, setting TTL to {ttl_seconds}s"
+                    elapsed = (now - last_online_time).total_seconds()
+                    if elapsed >= ttl_seconds:
+                        # A key this short could expire before its event can be
+                        # received, so overdue devices skip Redis altogether
+                        overdue_device_ids.append(device.id)
+                        continue
+                    # A last event in the future (clock skew) keeps the full TTL
+                    if elapsed > 0:
+                        ttl_seconds -= elapsed
+                    ttl_seconds = max(1, round(ttl_seconds))
+                    logger.debug(
+                        "Device %s (%s) last online at %s, setting TTL to %ss",
+                        device.id,
+                        device.name,
+                        last_online_time,
+                        ttl_seconds,
                     )
                 else:
                     logger.warning(
-                        f"No history found for device {device.id} ({device.name}), not setting TTL"
+                        "No history found for device %s (%s), not setting TTL",
+                        device.id,
+                        device.name,
                     )
                     continue
 
-                # Set the device as online in Redis
-                self.redis_mgr.set_device_online(int(device.id), int(ttl_seconds))
+                online_devices.append((int(device.id), int(ttl_seconds)))
+                logger.info(
+                    "Device %s (%s) initialized with TTL of %ss",
+                    device.id,
+                    device.name,
+                    ttl_seconds,
+                )
+
+            # Set all the devices as online in Redis in pipelined batches
+            self.redis_mgr.set_devices_online_bulk(online_devices)
+
+            if overdue_device_ids and bulk_mark_offline(db, overdue_device_ids):
                 logger.info(
-                    f"Device {device.id} ({device.name}) initialized with TTL of {ttl_seconds}s"
+                    "Marked %s overdue devices OFFLINE", len(overdue_device_ids)
                 )
 
             logger.info("Device initialization complete")
@@ -157,33 +176,41 @@ class DeviceStatusService:
             # Get the device from the database
             device = db.query(Device).filter(Device.id == device_id).first()
             if not device:
-                logger.warning(f"Device {device_id} not found in database")
+                logger.warning("Device %s not found in database", device_id)
                 return False
 
             if not device.expected_transmit_time:
                 logger.warning(
-                    f"Device {device_id} has no expected transmit time configured"
+                    "Device %s has no expected transmit time configured", device_id
                 )
                 return False
 
             # Calculate TTL in seconds
             ttl_seconds = device.expected_transmit_time * 60
 
-            # Set the device as online in Redis
-            self.redis_mgr.set_device_online(int(device_id), int(ttl_seconds))
+            # Set the device as online in Redis, learning in the same round-trip
+            # whether its key had expired (i.e. this transmission brings it online)
+            transitioned = self.redis_mgr.mark_device_online(
+                int(device_id), int(ttl_seconds)
+            )
 
-            # Update device status in database if it's not already online
-            if device.status != DeviceStatus.ONLINE:
+            # Update device status in database if it has just come back online,
+            # or the database does not have it as online yet
+            if transitioned or device.status != DeviceStatus.ONLINE:
                 update_device_status(
                     db, device_id=device_id, status=DeviceStatus.ONLINE
                 )
                 db.commit()
                 logger.info(
-                    f"Device {device_id} ({device.name}) marked ONLINE after transmission"
+                    "Device %s (%s) marked ONLINE after transmission",
+                    device_id,
+                    device.name,
                 )
             else:
                 logger.debug(
-                    f"Device {device_id} ({device.name}) already ONLINE, TTL reset"
+                    "Device %s (%s) already ONLINE, TTL reset",
+                    device_id,
+                    device.name,
                 )
 
             return True
@@ -208,12 +235,13 @@ class DeviceStatusService:
     def run_service(self):
         """Run the complete device status service."""
         try:
+            # Start the subscriber for expiry events first, so no key set while
+            # initializing can expire before its event is listened for
+            self.start_subscriber()
+
             # Initialize devices from database into Redis
             self.initialize_devices()
 
-            # Start the subscriber for expiry events
-            self.start_subscriber()
-
             logger.info("Device Status Service running")
             return True
 
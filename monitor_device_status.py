@@ -13,12 +13,74 @@ Run this script to get a snapshot of your device status system.
 import sys
 import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import redis
+from sqlalchemy import and_, func, select
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import joinedload
 from app.db.database import SessionLocal
-from app.models.device import Device
+from app.models.device import Device, DeviceStatus
 from app.models.device_history import DeviceHistory
+from app.redis.client import get_connection_pool
 from app.redis.redis_manager import RedisDeviceManager
-from app.core.config import settings
+from app.core.config import REDIS_KW
+
+# Whether stdout is a terminal; piped or redirected output is written without
+# ANSI colors and with an ASCII sync indicator instead of the emoji
+_IS_TTY = sys.stdout.isatty()
+
+# ANSI color for each device status
+_STATUS_COLOR = {
+    "online": "\033[92m",  # Green for online
+    "offline": "\033[91m",  # Red for offline
+    "maintenance": "\033[93m",  # Yellow for maintenance
+}
+_DEFAULT_STATUS_COLOR = _STATUS_COLOR["online"]
+_RESET_COLOR = "\033[0m"
+
+# Indicator shown when Redis and DB are out of sync, keyed by (database status,
+# whether the device should have a Redis key, whether the Redis key exists)
+_SYNC_INDICATOR = " ⚠️" if _IS_TTY else " !"
+_SYNC_WARNING = {
+    ("online", True, False): _SYNC_INDICATOR,  # Online in DB but not in Redis
+    ("offline", False, True): _SYNC_INDICATOR,  # Offline in DB but has Redis key
+}
+
+# Redis client shared by every snapshot; its pool keeps idle connections alive
+# (TCP keepalive plus health checks) and retries commands on timeout, so
+# repeated polls reuse warm sockets instead of reconnecting
+_redis_client = redis.Redis(connection_pool=get_connection_pool(**REDIS_KW))
+
+# Number of devices read from the database cursor per batch
+STREAM_BATCH_SIZE = 500
+
+# Runs the Redis lookups of a batch while the next batch is fetched
+_redis_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="monitor-redis")
+
+# Layout of one table row, filled in with str.format_map for every device;
+# the plain layout leaves out the color codes
+if _IS_TTY:
+    _ROW_FORMAT = "{id:^5} | {name:^20} | {color}{status:^10}{reset}{sync} | {ttl:^15} | {history:40}"
+else:
+    _ROW_FORMAT = "{id:^5} | {name:^20} | {status:^10}{sync} | {ttl:^15} | {history:40}"
+
+# Last snapshot returned by get_device_status, for callers passing ttl_ms
+_cached_snapshot = None
+_cached_at = 0.0
+# Bumped by invalidate_device_status_cache
+_cache_generation = 0
+
+
+@lru_cache(maxsize=1)
+def _get_redis_manager():
+    """
+    Get the RedisDeviceManager used by the monitor, created on first use.
+
+    Reusing it across snapshots skips the keyspace event configuration; it
+    runs its commands on the module's shared Redis client.
+    """
+    return RedisDeviceManager(**REDIS_KW, client=_redis_client)
 
 
 def format_time_remaining(ttl_seconds):
@@ -40,88 +102,219 @@ def format_time_remaining(ttl_seconds):
         return f"{seconds}s"
 
 
-def get_device_status():
+def format_times_remaining(ttls):
+    """
+    Format many TTLs at once, formatting each distinct value only once.
+
+    Devices brought online together share the same remaining TTL, so a fleet
+    snapshot usually contains far fewer distinct values than devices.
+    """
+    formatted = {}
+    result = []
+    for ttl in ttls:
+        text = formatted.get(ttl)
+        if text is None:
+            text = formatted[ttl] = format_time_remaining(ttl)
+        result.append(text)
+    return result
+
+
+def invalidate_device_status_cache():
+    """
+    Discard the cached snapshot, e.g. after devices are created or deleted.
+
+    Bumping the generation also stops a snapshot that was being fetched while
+    this ran from being cached.
+    """
+    global _cache_generation, _cached_snapshot
+    _cache_generation += 1
+    _cached_snapshot = None
+
+
+def get_device_status(ttl_ms=0, db=None):
     """
     Get comprehensive device status information combining database and Redis data.
 
+    Args:
+        ttl_ms: Reuse the previous snapshot if it is younger than this many
+            milliseconds; 0 (the default) always fetches a fresh one
+        db: Database session to query with; a new one is opened and closed
+            when not given
+
     Returns a list of dictionaries with device status information.
     """
-    db = SessionLocal()
-    # Initialize RedisDeviceManager instead of RedisClient
-    redis_manager = RedisDeviceManager(
-        host=getattr(settings, "REDIS_HOST", "localhost"),
-        port=getattr(settings, "REDIS_PORT", 6379),
-        db=getattr(settings, "REDIS_DB", 0),
-        password=getattr(settings, "REDIS_PASSWORD", None),
-    )
-    status_info = []
+    global _cached_snapshot, _cached_at
 
-    try:
-        # Get all devices with their latest history entry
-        devices = db.query(Device).all()
-
-        for device in devices:
-            device_id = device.id
-
-            # Get device's latest history entry
-            latest_history = (
-                db.query(DeviceHistory)
-                .filter(DeviceHistory.device_id == device_id)
-                .order_by(DeviceHistory.timestamp.desc())
-                .first()
-            )
+    if (
+        ttl_ms > 0
+        and _cached_snapshot is not None
+        and time.monotonic() - _cached_at < ttl_ms / 1000
+    ):
+        return _cached_snapshot
 
-            # Get TTL from Redis for this device
-            ttl = redis_manager.get_device_ttl(device_id)
+    generation = _cache_generation
+    if db is None:
+        db = SessionLocal()
+        try:
+            status_info = _fetch_device_status(db)
+        finally:
+            db.close()
+    else:
+        status_info = _fetch_device_status(db)
 
-            history_info = {}
-            if latest_history:
-                history_info = {
-                    "timestamp": latest_history.timestamp,
-                    "event": latest_history.event,
-                    "data": latest_history.data,
-                }
+    # Stamp the snapshot once the queries have completed, so its age is not
+    # overstated by the time they took; failed fetches are never cached
+    if status_info and generation == _cache_generation:
+        _cached_snapshot = status_info
+        _cached_at = time.monotonic()
+    return status_info
 
-            # Check if Redis key exists
-            redis_status = redis_manager.get_device_status(device_id)
 
-            status_info.append(
-                {
-                    "id": device_id,
-                    "name": device.name,
-                    "status": device.status,
-                    "expected_transmit_time": device.expected_transmit_time,
-                    "ttl": ttl,
-                    "ttl_formatted": format_time_remaining(ttl),
-                    "redis_key_exists": redis_status == "online",
-                    "latest_history": history_info,
-                }
+def _fetch_device_status(db):
+    """Query the database and Redis for a fresh device status snapshot."""
+    redis_manager = _get_redis_manager()
+    status_info = []
+
+    try:
+        # Devices are read as plain Core rows, each carrying its latest history
+        # entry as a JSONB object built by a correlated subquery; one statement
+        # returns everything, served per device by ix_device_history_device_ts
+        latest_history = (
+            select(
+                func.jsonb_build_object(
+                    "timestamp",
+                    DeviceHistory.timestamp,
+                    "event",
+                    DeviceHistory.event,
+                    "data",
+                    DeviceHistory.data,
+                    type_=JSONB,
+                )
             )
+            .where(DeviceHistory.device_id == Device.id)
+            .order_by(DeviceHistory.timestamp.desc())
+            .limit(1)
+            .scalar_subquery()
+            .label("latest_history")
+        )
+        stmt = select(
+            Device.id,
+            Device.name,
+            Device.status,
+            Device.expected_transmit_time,
+            # Whether the device should have a Redis key: it is online and its
+            # transmissions refresh a TTL (devices without an expected transmit
+            # time never get one), so a missing key means the stores disagree
+            and_(
+                Device.expected_transmit_time.isnot(None),
+                Device.status == DeviceStatus.ONLINE,
+            ).label("should_be_alive"),
+            latest_history,
+        ).execution_options(stream_results=True)
+
+        # Stream the devices through a server-side cursor in batches; the Redis
+        # statuses of each batch are fetched in one pipelined round-trip in the
+        # background while the next batch is read from the database
+        pending = None
+        for devices in db.execute(stmt).mappings().partitions(STREAM_BATCH_SIZE):
+            redis_future = _redis_executor.submit(
+                redis_manager.get_many_device_snapshots,
+                [device["id"] for device in devices],
+            )
+            if pending:
+                _append_device_statuses(status_info, *pending)
+            pending = (devices, redis_future)
+        if pending:
+            _append_device_statuses(status_info, *pending)
+
+        # Format the TTLs of all devices in one pass
+        ttls_formatted = format_times_remaining(info["ttl"] for info in status_info)
+        for info, ttl_formatted in zip(status_info, ttls_formatted):
+            info["ttl_formatted"] = ttl_formatted
 
         return status_info
 
     except Exception as e:
         print(f"Error fetching device status: {e}")
         return []
-    finally:
-        db.close()
+
+
+def _append_device_statuses(status_info, devices, redis_future):
+    """Append the status of a batch of devices once its Redis lookup is done."""
+    redis_snapshots = redis_future.result()
+
+    for device in devices:
+        device_id = device["id"]
+        redis_status, ttl = redis_snapshots[device_id]
+
+        history_info = device["latest_history"] or {}
+        if history_info:
+            # JSON has no datetime type, so the timestamp comes back as text
+            history_info["timestamp"] = datetime.fromisoformat(
+                history_info["timestamp"]
+            )
+
+        status_info.append(
+            {
+                "id": device_id,
+                "name": device["name"],
+                "status": device["status"].value,
+                "expected_transmit_time": device["expected_transmit_time"],
+                "should_be_alive": device["should_be_alive"],
+                "ttl": ttl,
+                "redis_key_exists": redis_status == "online",
+                "latest_history": history_info,
+            }
+        )
+
+
+def get_device_status_counts(db):
+    """
+    Count the devices in each status.
+
+    The counts are aggregated by the database, so no device rows are shipped
+    to Python just to be counted.
+
+    Args:
+        db: The database session
+
+    Returns:
+        dict: Number of devices keyed by status value, empty on error
+    """
+    try:
+        rows = db.execute(
+            select(Device.status, func.count()).group_by(Device.status)
+        ).all()
+        return {status.value: count for status, count in rows}
+    except Exception as e:
+        print(f"Error counting device statuses: {e}")
+        return {}
 
 
 def print_device_status():
     """
     Print a formatted display of all device statuses
     """
-    status_info = get_device_status()
+    # The snapshot and the status counts share one session; the counts are
+    # only queried when there is a snapshot to show them with
+    db = SessionLocal()
+    try:
+        status_info = get_device_status(db=db)
+        status_counts = get_device_status_counts(db) if status_info else {}
+    finally:
+        db.close()
 
     if not status_info:
         print("No devices found in the database.")
         return
 
-    print("\n" + "=" * 100)
-    print(
-        f"{'ID':^5} | {'NAME':^20} | {'STATUS':^10} | {'TTL REMAINING':^15} | {'LAST EVENT':^40}"
-    )
-    print("-" * 100)
+    # Build the whole table first and write it to stdout in one call
+    lines = [
+        "",
+        "=" * 100,
+        f"{'ID':^5} | {'NAME':^20} | {'STATUS':^10} | {'TTL REMAINING':^15} | {'LAST EVENT':^40}",
+        "-" * 100,
+    ]
 
     for device in status_info:
         # Format history information
@@ -137,32 +330,46 @@ def print_device_status():
             history_text = f"{timestamp} - {event} - {status_change}"
 
         # Colorize status (ANSI colors)
-        status_color = "\033[92m"  # Green for online
-        if device["status"] == "offline":
-            status_color = "\033[91m"  # Red for offline
-        elif device["status"] == "maintenance":
-            status_color = "\033[93m"  # Yellow for maintenance
-        reset_color = "\033[0m"
+        status_color = _STATUS_COLOR.get(device["status"], _DEFAULT_STATUS_COLOR)
 
         # Add an indicator if Redis and DB are out of sync
-        sync_status = ""
-        if device["status"] == "online" and not device["redis_key_exists"]:
-            sync_status = (
-                " ⚠️"  # Warning emoji if device is online in DB but not in Redis
-            )
-        elif device["status"] == "offline" and device["redis_key_exists"]:
-            sync_status = (
-                " ⚠️"  # Warning emoji if device is offline in DB but has Redis key
-            )
+        sync_status = _SYNC_WARNING.get(
+            (
+                device["status"],
+                device["should_be_alive"],
+                device["redis_key_exists"],
+            ),
+            "",
+        )
 
-        print(
-            f"{device['id']:^5} | {device['name'][:20]:^20} | {status_color}{device['status']:^10}{reset_color}{sync_status} | {device['ttl_formatted']:^15} | {history_text[:40]:40}"
+        lines.append(
+            _ROW_FORMAT.format_map(
+                {
+                    "id": device["id"],
+                    "name": device["name"][:20],
+                    "color": status_color,
+                    "status": device["status"],
+                    "reset": _RESET_COLOR,
+                    "sync": sync_status,
+                    "ttl": device["ttl_formatted"],
+                    "history": history_text[:40],
+                }
+            )
         )
 
-    print("=" * 100)
-    print(f"Total devices: {len(status_info)}")
-    print(f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("=" * 100)
+    lines += [
+        "=" * 100,
+        f"Total devices: {len(status_info)}",
+        "By status: "
+        + ", ".join(
+            f"{status.value}: {status_counts.get(status.value, 0)}"
+            for status in DeviceStatus
+        ),
+        f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        "=" * 100,
+    ]
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
 
 
 if __name__ == "__main__":